@@ -1,6 +1,9 @@
+import altair as alt
+import numpy as np
 import pandas as pd
 import streamlit as st
 from itertools import product
+import hashlib
 from datetime import datetime, time as dt_time
 import time
 from io import BytesIO
@@ -112,9 +115,15 @@ st.markdown("""
 # Utilitaires
 # ─────────────────────────────────────────────
 def to_excel(df: pd.DataFrame) -> bytes:
+    return to_excel_feuilles({'Sheet1': df})
+
+
+def to_excel_feuilles(feuilles: dict[str, pd.DataFrame]) -> bytes:
+    """Classeur Excel avec une feuille par entrée {nom de feuille: tableau}."""
     output = BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sheet1')
+        for nom, df in feuilles.items():
+            df.to_excel(writer, index=False, sheet_name=nom)
     return output.getvalue()
 
 
@@ -136,6 +145,109 @@ def formatter_auteur(cle: str) -> str:
     return " ".join(m.capitalize() for m in cle.split())
 
 
+# ─────────────────────────────────────────────
+# Aperçu paginé des grands tableaux
+# ─────────────────────────────────────────────
+APERCU_TAILLES_PAGE = [50, 100, 250, 500]
+
+
+def _rang_tri(df: pd.DataFrame, col: str) -> np.ndarray:
+    """Rang dense croissant des valeurs de col (NaN pour les valeurs vides)."""
+    try:
+        rang = df[col].rank(method="dense")
+    except TypeError:
+        # Colonne objet de types mélangés : tri sur la représentation texte
+        rang = df[col].astype(str).rank(method="dense")
+    return rang.to_numpy(dtype=float)
+
+
+def _index_tri(rang: np.ndarray, croissant: bool) -> np.ndarray:
+    """
+    Positions triées selon rang (tri stable, valeurs vides en fin). L'ordre
+    décroissant trie le rang négatif : un seul rang par colonne suffit et les
+    ex æquo gardent leur ordre d'origine dans les deux sens.
+    """
+    cle = rang if croissant else -rang
+    return np.argsort(np.where(np.isnan(cle), np.inf, cle), kind="stable")
+
+
+def _masque_recherche(df: pd.DataFrame, texte: str) -> np.ndarray:
+    """Lignes dont au moins une cellule contient texte (insensible à la casse)."""
+    masque = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        masque |= (
+            df[col].astype(str)
+            .str.contains(texte, case=False, regex=False, na=False)
+            .to_numpy()
+        )
+    return masque
+
+
+@st.fragment
+def afficher_apercu_pagine(df: pd.DataFrame, key: str, signature):
+    """
+    Affiche un aperçu paginé de df : tri et recherche sont faits côté serveur,
+    seule la page courante est envoyée au navigateur.
+    Le rang de la dernière colonne triée, le dernier index de tri et le dernier
+    masque de recherche sont gardés en session tant que `signature` ne change
+    pas — elle doit identifier le contenu de df.
+    Fragment Streamlit : les widgets de l'aperçu ne relancent que l'aperçu,
+    pas la page (ni la génération des téléchargements).
+    """
+    if df.empty:
+        st.info("Aucune ligne à afficher.")
+        return
+
+    cle_cache = f"_apercu_{key}"
+    cache = st.session_state.get(cle_cache)
+    if cache is None or cache["signature"] != signature:
+        cache = {"signature": signature, "rang": None, "tri": None, "recherche": {}, "vue": None}
+        st.session_state[cle_cache] = cache
+
+    c1, c2, c3, c4, c5 = st.columns([3, 2, 1, 1, 1])
+    with c1:
+        texte = st.text_input("🔎 Rechercher", key=f"{key}_recherche").strip()
+    with c2:
+        col_tri = st.selectbox("Trier par", ["(aucun)"] + list(df.columns), key=f"{key}_tri")
+    with c3:
+        ordre = st.selectbox("Ordre", ["Croissant", "Décroissant"], key=f"{key}_ordre")
+    with c4:
+        taille = st.selectbox("Lignes / page", APERCU_TAILLES_PAGE, key=f"{key}_taille")
+
+    positions = np.arange(len(df))
+    if col_tri != "(aucun)":
+        cle_tri = (col_tri, ordre == "Croissant")
+        if cache["tri"] is None or cache["tri"][0] != cle_tri:
+            if cache["rang"] is None or cache["rang"][0] != col_tri:
+                cache["rang"] = (col_tri, _rang_tri(df, col_tri))
+            cache["tri"] = (cle_tri, _index_tri(cache["rang"][1], cle_tri[1]))
+        positions = cache["tri"][1]
+    if texte:
+        if texte not in cache["recherche"]:
+            cache["recherche"] = {texte: _masque_recherche(df, texte)}
+        positions = positions[cache["recherche"][texte][positions]]
+
+    nb_lignes = len(positions)
+    nb_pages  = max(1, -(-nb_lignes // taille))
+    cle_page  = f"{key}_page"
+    vue = (texte, col_tri, ordre, taille)
+    if cache["vue"] is not None and cache["vue"] != vue:
+        st.session_state[cle_page] = 1
+    cache["vue"] = vue
+    if st.session_state.get(cle_page, 1) > nb_pages:
+        st.session_state[cle_page] = nb_pages
+    with c5:
+        page_num = st.number_input("Page", min_value=1, max_value=nb_pages, step=1, key=cle_page)
+
+    debut = (int(page_num) - 1) * taille
+    fin   = min(debut + taille, nb_lignes)
+    st.dataframe(df.iloc[positions[debut:fin]], use_container_width=True, hide_index=True)
+    if nb_lignes:
+        st.caption(f"Lignes {debut + 1:,} à {fin:,} sur {nb_lignes:,} — page {int(page_num)} / {nb_pages}")
+    else:
+        st.caption("Aucune ligne ne correspond à la recherche.")
+
+
 # ─────────────────────────────────────────────
 # Mapping colonnes CSV produit
 # ─────────────────────────────────────────────
@@ -156,6 +268,63 @@ COL_DETAIL_VENTE = "Detail de commande - prixFinalHt"
 COL_DETAIL_QTE   = "Detail de commande - Quantité"
 
 
+# ─────────────────────────────────────────────
+# Éclatement multi-offres
+# ─────────────────────────────────────────────
+RAISON_OFFRES_INCOHERENTES = "Exclus — Nombre d'offres incohérent (prix / Id)"
+
+
+def _parties(serie: pd.Series, virgule_decimale: bool = False) -> np.ndarray:
+    """
+    Toutes les parties '|' de la série, à plat dans l'ordre des lignes, en un
+    seul tableau de chaînes. Avec virgule_decimale, ',' devient '.' sur le texte
+    concaténé (une passe) avant le découpage.
+    """
+    if not len(serie):
+        return np.array([], dtype=str)
+    texte = serie.str.cat(sep="|")
+    if virgule_decimale:
+        texte = texte.replace(",", ".")
+    return np.array(texte.split("|"), dtype=str)
+
+
+def eclater_multi_offres(data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Éclate les cellules multi-offres (« a|b|c ») des colonnes prix de vente,
+    prix d'achat et Id offre en une ligne par offre.
+
+    Le nombre de parties est compté une fois par colonne ; les autres colonnes
+    sont répliquées par position via np.repeat. Les prix sont convertis
+    directement en float (virgule décimale acceptée).
+    Retourne (lignes éclatées, lignes rejetées) — les lignes dont les trois
+    colonnes n'ont pas le même nombre de parties sont rejetées avec une
+    'Exclusion Reason' (prix vidés pour garder des colonnes numériques)
+    au lieu de faire échouer le traitement.
+    """
+    cols_a_eclater = [COL_PRIX_VENTE, COL_PRIX_ACHAT, COL_OFFRE_ID]
+    textes = {col: data[col].fillna("nan").astype(str) for col in cols_a_eclater}
+    nb_parties = {col: textes[col].str.count(r"\|").to_numpy() + 1 for col in cols_a_eclater}
+
+    coherent = (
+        (nb_parties[COL_PRIX_VENTE] == nb_parties[COL_PRIX_ACHAT])
+        & (nb_parties[COL_PRIX_VENTE] == nb_parties[COL_OFFRE_ID])
+    )
+    rejetees = data[~coherent].copy()
+    rejetees[[COL_PRIX_VENTE, COL_PRIX_ACHAT]] = np.nan
+    rejetees["Exclusion Reason"] = RAISON_OFFRES_INCOHERENTES
+
+    positions = np.flatnonzero(coherent)
+    repetitions = np.repeat(positions, nb_parties[COL_PRIX_VENTE][coherent])
+    eclatees = data.iloc[repetitions].reset_index(drop=True)
+
+    for col in [COL_PRIX_VENTE, COL_PRIX_ACHAT]:
+        parties = _parties(textes[col].iloc[positions], virgule_decimale=True)
+        eclatees[col] = np.asarray(pd.to_numeric(parties, errors="coerce"), dtype=float)
+    eclatees[COL_OFFRE_ID] = _parties(textes[COL_OFFRE_ID].iloc[positions]).astype(object)
+
+    return eclatees, rejetees
+
+
 # ─────────────────────────────────────────────
 # Calcul taux de marge depuis les détails
 # ─────────────────────────────────────────────
@@ -194,6 +363,155 @@ def compute_total_achat(row) -> float | None:
         return None
 
 
+# ─────────────────────────────────────────────
+# Préparation & distribution des marges commandes
+# ─────────────────────────────────────────────
+MARGE_TRANCHES = [0, 5, 10, 15, 20, 25, 30, 40, 50]
+MARGE_LIBELLES = (
+    [f"< {MARGE_TRANCHES[0]} %"]
+    + [f"{a} – {b} %" for a, b in zip(MARGE_TRANCHES, MARGE_TRANCHES[1:])]
+    + [f"≥ {MARGE_TRANCHES[-1]} %"]
+)
+DECILES = [i / 10 for i in range(1, 10)]
+
+
+@st.cache_resource(show_spinner="Préparation des commandes…", max_entries=2, ttl=3600)
+def preparer_commandes(empreinte: str, _contenu: bytes) -> tuple[pd.DataFrame, str | None]:
+    """
+    Lit l'export commandes et calcule taux de marge, CA réel et valeurs de marge.
+    Mis en cache sur l'empreinte du fichier (voir empreinte_fichier ; le contenu
+    n'est pas haché à chaque appel), sans copie à chaque appel : le tableau
+    retourné est partagé et ne doit pas être modifié (filtrer_commandes en fait une copie).
+    Retourne (commandes, format) avec format 'A' (taux_marge fourni),
+    'B' (détails de commande) ou None si non reconnu.
+    """
+    df = pd.read_csv(BytesIO(_contenu))
+    df.columns = [c.replace("Commande - ", "").strip() for c in df.columns]
+
+    df["Prix produits (HT)"] = pd.to_numeric(df["Prix produits (HT)"], errors="coerce")
+    df["Prix final (HT)"]    = pd.to_numeric(df["Prix final (HT)"],    errors="coerce")
+    df["Remise (HT)"]        = pd.to_numeric(df.get("Remise (HT)"),    errors="coerce").fillna(0)
+
+    col_detail_achat_s = COL_DETAIL_ACHAT.replace("Commande - ", "").strip()
+    col_detail_vente_s = COL_DETAIL_VENTE.replace("Commande - ", "").strip()
+    col_detail_qte_s   = COL_DETAIL_QTE.replace("Commande - ", "").strip()
+
+    if all(c in df.columns for c in [col_detail_achat_s, col_detail_vente_s, col_detail_qte_s]):
+        format_ = "B"
+        df = df.rename(columns={
+            col_detail_achat_s: COL_DETAIL_ACHAT,
+            col_detail_vente_s: COL_DETAIL_VENTE,
+            col_detail_qte_s:   COL_DETAIL_QTE,
+        })
+        df["taux_marge"]     = df.apply(compute_taux_marge_from_detail, axis=1)
+        df["total_achat_HT"] = df.apply(compute_total_achat, axis=1)
+        df["ca_reel"]        = df["Prix produits (HT)"] - df["Remise (HT)"].fillna(0)
+        df["valeur_achat"]   = df["total_achat_HT"]
+        df["valeur_marge"]   = df["ca_reel"] - df["total_achat_HT"]
+    elif "taux_marge" in df.columns:
+        format_ = "A"
+        df["taux_marge"]     = pd.to_numeric(df["taux_marge"], errors="coerce")
+        df["total_achat_HT"] = None
+        df["ca_reel"]        = df["Prix produits (HT)"]
+        df["valeur_marge"]   = df["Prix produits (HT)"] * df["taux_marge"] / 100
+        df["valeur_achat"]   = df["Prix produits (HT)"] - df["valeur_marge"]
+    else:
+        return df, None
+
+    # Regroupe les variantes d'inversion prénom/nom (ex: "Arthur PITAULT" = "Pitault Arthur")
+    df["Auteur"] = (
+        df["Auteur"]
+        .fillna("(Sans commercial)")
+        .apply(normaliser_auteur)
+        .apply(formatter_auteur)
+    )
+    df["Etat"] = df["Etat"].fillna("(Inconnu)").str.strip()
+    return df, format_
+
+
+def filtrer_commandes(df: pd.DataFrame, auteurs: list[str], etats: list[str]) -> pd.DataFrame:
+    """Commandes des auteurs et états sélectionnés (liste vide = pas de filtre)."""
+    masque = pd.Series(True, index=df.index)
+    if auteurs:
+        masque &= df["Auteur"].isin(auteurs)
+    if etats:
+        masque &= df["Etat"].isin(etats)
+    return df[masque].copy()
+
+
+def empreinte_fichier(fichier) -> str:
+    """Empreinte SHA-256 du fichier chargé, calculée une seule fois par upload (file_id)."""
+    if st.session_state.get("_empreinte_file_id") != fichier.file_id:
+        st.session_state["_empreinte"]         = hashlib.sha256(fichier.getvalue()).hexdigest()
+        st.session_state["_empreinte_file_id"] = fichier.file_id
+    return st.session_state["_empreinte"]
+
+
+@st.cache_data(show_spinner="Calcul des distributions de marge…", max_entries=32, ttl=3600)
+def distribution_marge(empreinte: str, _contenu: bytes,
+                       auteurs: tuple, etats: tuple) -> dict[str, pd.DataFrame]:
+    """
+    Distribution des taux de marge par commercial, en une passe vectorisée :
+    déciles (quantiles groupés) et histogramme par tranche (np.digitize puis
+    np.bincount sur le couple commercial × tranche).
+    Mis en cache avec la préparation des commandes (même empreinte de fichier).
+    Retourne {} si aucune commande filtrée n'a de taux de marge.
+    """
+    df = filtrer_commandes(preparer_commandes(empreinte, _contenu)[0], list(auteurs), list(etats))
+    df = df[df["taux_marge"].notna()]
+    if df.empty:
+        return {}
+
+    taux  = df["taux_marge"].to_numpy(dtype=float)
+    marge = df["valeur_marge"].fillna(0).to_numpy(dtype=float)
+    codes, noms = pd.factorize(df["Auteur"], sort=True)
+    nb_auteurs, nb_tranches = len(noms), len(MARGE_LIBELLES)
+
+    cellules = codes * nb_tranches + np.digitize(taux, MARGE_TRANCHES)
+    taille   = nb_auteurs * nb_tranches
+    nb_cmd   = np.bincount(cellules, minlength=taille).reshape(nb_auteurs, nb_tranches)
+    val_cmd  = np.bincount(cellules, weights=marge, minlength=taille).reshape(nb_auteurs, nb_tranches)
+
+    nb_total = nb_cmd.sum(axis=1)
+    deciles = df.groupby("Auteur")["taux_marge"].quantile(DECILES).unstack().reindex(noms)
+    deciles.columns = [f"D{i}" for i in range(1, 10)]
+    deciles.insert(0, "Nb_commandes", nb_total)
+
+    histogramme = pd.DataFrame({
+        "Auteur":       np.repeat(noms.to_numpy(), nb_tranches),
+        "Tranche":      np.tile(MARGE_LIBELLES, nb_auteurs),
+        "Nb_commandes": nb_cmd.ravel(),
+        "Valeur_marge": val_cmd.ravel(),
+    })
+
+    return {
+        "deciles":     deciles.reset_index(names="Auteur"),
+        "histogramme": histogramme,
+    }
+
+
+def sous_plancher_marge(df_filtre: pd.DataFrame, plancher: float) -> pd.DataFrame:
+    """
+    Commandes sous le plancher de marge par commercial (np.bincount sur taux < plancher).
+    Calcul léger, hors cache : seul ce tableau change quand le plancher change.
+    """
+    df = df_filtre[df_filtre["taux_marge"].notna()]
+    codes, noms = pd.factorize(df["Auteur"], sort=True)
+    sous  = df["taux_marge"].to_numpy(dtype=float) < plancher
+    marge = df["valeur_marge"].fillna(0).to_numpy(dtype=float)
+
+    nb_total = np.bincount(codes, minlength=len(noms))
+    nb_sous  = np.bincount(codes, weights=sous, minlength=len(noms)).astype(int)
+    return pd.DataFrame({
+        "Auteur":              noms.to_numpy(),
+        "Plancher_marge":      plancher,
+        "Nb_commandes":        nb_total,
+        "Nb_sous_plancher":    nb_sous,
+        "Part_sous_plancher":  nb_sous / nb_total * 100,
+        "Marge_sous_plancher": np.bincount(codes, weights=marge * sous, minlength=len(noms)),
+    })
+
+
 # ─────────────────────────────────────────────
 # NAVIGATION
 # ─────────────────────────────────────────────
@@ -297,20 +615,17 @@ if page == "📦 Calculateur Prix Promo":
                     st.stop()
 
                 # ── Éclatement multi-offres ───────────────────────────────────
-                cols_a_eclater = [COL_PRIX_VENTE, COL_PRIX_ACHAT, COL_OFFRE_ID]
-                for col in cols_a_eclater:
-                    data[col] = data[col].astype(str).str.split('|')
                 avant = len(data)
-                data = data.explode(cols_a_eclater).reset_index(drop=True)
-                if len(data) > avant:
+                data, data_incoherentes = eclater_multi_offres(data)
+                if not data_incoherentes.empty:
+                    update_status(
+                        f"{len(data_incoherentes):,} ligne(s) exclue(s) : "
+                        f"nombre d'offres différent entre prix et Id."
+                    )
+                if len(data) > (avant := avant - len(data_incoherentes)):
                     update_status(f"Éclatement multi-offres : {avant:,} → {len(data):,} lignes.")
                 update_status(f"Produits / offres à traiter : {len(data):,}")
 
-                data[COL_PRIX_VENTE] = pd.to_numeric(
-                    data[COL_PRIX_VENTE].astype(str).str.replace(",", "."), errors="coerce")
-                data[COL_PRIX_ACHAT] = pd.to_numeric(
-                    data[COL_PRIX_ACHAT].astype(str).str.replace(",", "."), errors="coerce")
-
                 before = len(data)
                 data[COL_OFFRE_ID] = data[COL_OFFRE_ID].replace("nan", pd.NA)
                 data = data.dropna(subset=[COL_PRIX_VENTE, COL_PRIX_ACHAT, COL_OFFRE_ID])
@@ -362,6 +677,7 @@ if page == "📦 Calculateur Prix Promo":
                 for df_ in [data_processed, data_excluded]:
                     df_.drop(columns=['Identifiant fournisseur', 'Identifiant famille', '_merge'],
                              inplace=True)
+                data_excluded = pd.concat([data_incoherentes, data_excluded], ignore_index=True)
 
                 update_status(f"Produits exclus : {len(data_excluded):,}")
                 update_status(f"Produits à traiter : {len(data_processed):,}")
@@ -452,6 +768,7 @@ if page == "📦 Calculateur Prix Promo":
                 st.session_state["margin_issues_df"]     = pd.DataFrame(margin_issues)
                 st.session_state["exclusion_reasons_df"] = exclusion_final_df
                 st.session_state["calcul_done"]          = True
+                st.session_state["calcul_id"]            = st.session_state.get("calcul_id", 0) + 1
                 update_status(f"✅ Calcul terminé — {len(result):,} offres promo générées.")
 
         except Exception as e:
@@ -484,6 +801,18 @@ if page == "📦 Calculateur Prix Promo":
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
 
+        st.markdown('<p class="section-title">Aperçu</p>', unsafe_allow_html=True)
+        tab_res, tab_marge, tab_excl = st.tabs(["Résultats", "Problèmes de marge", "Produits exclus"])
+        with tab_res:
+            afficher_apercu_pagine(st.session_state["result_df"], key="apercu_resultats",
+                                   signature=st.session_state["calcul_id"])
+        with tab_marge:
+            afficher_apercu_pagine(st.session_state["margin_issues_df"], key="apercu_marge",
+                                   signature=st.session_state["calcul_id"])
+        with tab_excl:
+            afficher_apercu_pagine(st.session_state["exclusion_reasons_df"], key="apercu_exclus",
+                                   signature=st.session_state["calcul_id"])
+
 
 # ══════════════════════════════════════════════
 # PAGE 2 — ANALYSE CA PAR COMMERCIAL
@@ -521,37 +850,18 @@ elif page == "📊 Analyse CA par Commercial":
     csv_file = st.file_uploader("📄 Charger le fichier export commandes (CSV)", type=["csv"], key="ca_csv")
 
     if csv_file is not None:
-        df = pd.read_csv(csv_file)
-        df.columns = [c.replace("Commande - ", "").strip() for c in df.columns]
-
-        df["Prix produits (HT)"] = pd.to_numeric(df["Prix produits (HT)"], errors="coerce")
-        df["Prix final (HT)"]    = pd.to_numeric(df["Prix final (HT)"],    errors="coerce")
-        df["Remise (HT)"]        = pd.to_numeric(df.get("Remise (HT)"),    errors="coerce").fillna(0)
-
-        col_detail_achat_s = COL_DETAIL_ACHAT.replace("Commande - ", "").strip()
-        col_detail_vente_s = COL_DETAIL_VENTE.replace("Commande - ", "").strip()
-        col_detail_qte_s   = COL_DETAIL_QTE.replace("Commande - ", "").strip()
-
-        has_detail_cols = all(c in df.columns for c in [col_detail_achat_s, col_detail_vente_s, col_detail_qte_s])
-        has_taux_marge  = "taux_marge" in df.columns
+        contenu_csv  = csv_file.getvalue()
+        empreinte    = empreinte_fichier(csv_file)
+        df, format_commandes = preparer_commandes(empreinte, contenu_csv)
+        has_detail_cols = format_commandes == "B"
 
         if has_detail_cols:
             st.info("📋 **Format B détecté** — taux de marge calculé depuis les détails de commande.")
-            df = df.rename(columns={
-                col_detail_achat_s: COL_DETAIL_ACHAT,
-                col_detail_vente_s: COL_DETAIL_VENTE,
-                col_detail_qte_s:   COL_DETAIL_QTE,
-            })
-            df["taux_marge"]     = df.apply(compute_taux_marge_from_detail, axis=1)
-            df["total_achat_HT"] = df.apply(compute_total_achat, axis=1)
-
             if (nb_sans_marge := df["taux_marge"].isna().sum()) > 0:
                 st.warning(f"⚠️ {nb_sans_marge:,} commande(s) sans taux de marge calculable.")
 
-        elif has_taux_marge:
+        elif format_commandes == "A":
             st.info("📋 **Format A détecté** — taux de marge lu depuis la colonne `taux_marge`.")
-            df["taux_marge"]     = pd.to_numeric(df["taux_marge"], errors="coerce")
-            df["total_achat_HT"] = None
 
         else:
             st.error(
@@ -560,16 +870,6 @@ elif page == "📊 Analyse CA par Commercial":
             )
             st.stop()
 
-        # ── Normalisation des auteurs ─────────────────────────────────────────
-        # Regroupe les variantes d'inversion prénom/nom (ex: "Arthur PITAULT" = "Pitault Arthur")
-        df["Auteur"] = (
-            df["Auteur"]
-            .fillna("(Sans commercial)")
-            .apply(normaliser_auteur)
-            .apply(formatter_auteur)
-        )
-        df["Etat"] = df["Etat"].fillna("(Inconnu)").str.strip()
-
         # ── Filtres ───────────────────────────────────────────────────────────
         st.markdown('<p class="section-title">Filtres</p>', unsafe_allow_html=True)
         col1, col2 = st.columns(2)
@@ -589,25 +889,13 @@ elif page == "📊 Analyse CA par Commercial":
                 placeholder="Tous les états…"
             )
 
-        masque_auteur = df["Auteur"].isin(auteurs_sel) if auteurs_sel else pd.Series([True] * len(df), index=df.index)
-        masque_etat   = df["Etat"].isin(etats_sel)    if etats_sel   else pd.Series([True] * len(df), index=df.index)
-        df_filtre = df[masque_auteur & masque_etat].copy()
+        df_filtre = filtrer_commandes(df, auteurs_sel, etats_sel)
 
         st.markdown(f"**{len(df_filtre):,} commandes** correspondent aux filtres sélectionnés.")
 
         if df_filtre.empty:
             st.warning("Aucune commande ne correspond à la sélection.")
         else:
-            # ── Calcul des valeurs ────────────────────────────────────────────
-            if has_detail_cols:
-                df_filtre["ca_reel"]      = df_filtre["Prix produits (HT)"] - df_filtre["Remise (HT)"].fillna(0)
-                df_filtre["valeur_achat"] = df_filtre["total_achat_HT"]
-                df_filtre["valeur_marge"] = df_filtre["ca_reel"] - df_filtre["total_achat_HT"]
-            else:
-                df_filtre["ca_reel"]      = df_filtre["Prix produits (HT)"]
-                df_filtre["valeur_marge"] = df_filtre["Prix produits (HT)"] * df_filtre["taux_marge"] / 100
-                df_filtre["valeur_achat"] = df_filtre["Prix produits (HT)"] - df_filtre["valeur_marge"]
-
             # ── Agrégation par commercial ─────────────────────────────────────
             agg = (
                 df_filtre
@@ -678,15 +966,57 @@ elif page == "📊 Analyse CA par Commercial":
             m4.metric("Taux marge moyen",   fmt_pct(df_filtre["taux_marge"].mean()))
             m5.metric("Taux marge pondéré", fmt_pct(total_val_marge / total_ca_ht * 100 if total_ca_ht else 0))
 
+            # ── Distribution des marges ───────────────────────────────────────
+            st.markdown('<p class="section-title">Distribution des marges</p>', unsafe_allow_html=True)
+            plancher = st.number_input("Plancher de marge (%)", value=5.0, step=1.0, key="plancher_marge")
+            distrib = distribution_marge(empreinte, contenu_csv, tuple(auteurs_sel), tuple(etats_sel))
+
+            if not distrib:
+                st.info("Aucune commande filtrée avec un taux de marge calculable.")
+            else:
+                histo         = distrib["histogramme"]
+                sous_plancher = sous_plancher_marge(df_filtre, plancher)
+                tab_dec, tab_histo, tab_sous = st.tabs(
+                    ["Déciles par commercial", "Histogramme", f"Sous {plancher:g} %"]
+                )
+                with tab_dec:
+                    st.dataframe(distrib["deciles"].round(2), use_container_width=True, hide_index=True)
+                with tab_histo:
+                    histo_global = histo.groupby("Tranche", as_index=False)["Nb_commandes"].sum()
+                    st.altair_chart(
+                        alt.Chart(histo_global).mark_bar().encode(
+                            x=alt.X("Tranche:N", sort=MARGE_LIBELLES, title="Tranche de marge"),
+                            y=alt.Y("Nb_commandes:Q", title="Nb commandes"),
+                        ),
+                        use_container_width=True
+                    )
+                    st.dataframe(
+                        histo.pivot(index="Auteur", columns="Tranche", values="Nb_commandes")[MARGE_LIBELLES],
+                        use_container_width=True
+                    )
+                with tab_sous:
+                    sous_display = sous_plancher.copy()
+                    sous_display["Plancher_marge"]      = sous_display["Plancher_marge"].apply(fmt_pct)
+                    sous_display["Part_sous_plancher"]  = sous_display["Part_sous_plancher"].apply(fmt_pct)
+                    sous_display["Marge_sous_plancher"] = sous_display["Marge_sous_plancher"].apply(fmt_eur)
+                    st.dataframe(sous_display, use_container_width=True, hide_index=True)
+
             # ── Exports ───────────────────────────────────────────────────────
             st.markdown('<p class="section-title">Téléchargements</p>', unsafe_allow_html=True)
             agg_export = agg.copy()
             col_dl1, col_dl2 = st.columns(2)
 
             with col_dl1:
+                feuilles_recap = {"Sheet1": agg_export}
+                if distrib:
+                    feuilles_recap.update({
+                        "Déciles marge":     distrib["deciles"],
+                        "Histogramme marge": distrib["histogramme"],
+                        "Sous plancher":     sous_plancher,
+                    })
                 st.download_button(
                     "⬇️ Récapitulatif par commercial (Excel)",
-                    data=to_excel(agg_export),
+                    data=to_excel_feuilles(feuilles_recap),
                     file_name="ca_par_commercial.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
@@ -705,5 +1035,12 @@ elif page == "📊 Analyse CA par Commercial":
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
 
+            # ── Aperçu du détail ──────────────────────────────────────────────
+            st.markdown('<p class="section-title">Détail des commandes</p>', unsafe_allow_html=True)
+            afficher_apercu_pagine(
+                detail_export, key="apercu_detail_ca",
+                signature=(csv_file.file_id, tuple(auteurs_sel), tuple(etats_sel)),
+            )
+
     else:
         st.info("👆 Chargez un fichier CSV pour démarrer l'analyse.")